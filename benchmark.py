@@ -0,0 +1,285 @@
+#! /usr/bin/env python3
+# Regression benchmark for the compression pipeline.
+#
+# Runs each stage on pinned synthetic corpora, recording time, throughput and
+# peak memory, and checks compressed size and round trip. Results are compared
+# against benchmark_baseline.json, exit status is 1 on any regression.
+#
+# Times are the best of several runs without tracemalloc, peak memory comes
+# from a separate traced run. Times are scaled by a calibration loop, so a
+# baseline stored on one machine can be checked on another.
+#
+#   ./benchmark.py                             # match finding up to 100kB
+#   ./benchmark.py --match-max-size 10000000   # all corpora, about three hours
+#   ./benchmark.py --update-baseline           # store current results as baseline
+#
+# --update-baseline only replaces the stages that ran, so a default run keeps
+# the stored 1MB and 10MB match and resolve baselines.
+import gc
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+import collections
+import compress
+import lz_compress
+
+# Corpus sizes in bytes of text, generated from a fixed seed.
+corpus_sizes = [ 10_000, 100_000, 1_000_000, 10_000_000 ]
+corpus_seed = 26
+
+# Tokenize and codes run on every corpus. Match finding is O(n*O*N) at a few
+# kB/s, so it and resolve, which needs its output, stop at --match-max-size.
+
+baseline_file = "benchmark_baseline.json"
+
+# Slowdowns below this are timer noise, not regressions.
+time_resolution = 0.02
+
+# Generate a text in the advent?.txt format: "#id\nmessage\n".
+# Messages are built from a fixed set of phrases, and some repeat earlier
+# messages whole, so the token stream has overlapping repeated runs for the
+# LZ stages. Words and phrases follow a Zipf distribution.
+def make_corpus(size, seed=corpus_seed):
+    rng = random.Random(seed)
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    vocabulary = sorted(set(
+        "".join(rng.choice(letters) for n in range(rng.randint(1, 10)))
+        for i in range(1500)
+    ))
+    rng.shuffle(vocabulary)
+    word_weights = [ 1/(rank+1) for rank in range(len(vocabulary)) ]
+    separators = [ "", "", "", "", "", "", ",", ".", "?", "!", "-", "'", "\"", "/" ]
+
+    phrases = [
+        " ".join(rng.choices(vocabulary, word_weights, k=rng.randint(2, 8))) + rng.choice(separators)
+        for i in range(300)
+    ]
+    phrase_weights = [ 1/(rank+1) for rank in range(len(phrases)) ]
+
+    parts = []
+    length = 0
+    messages = []
+    while length < size:
+        if messages and rng.random() < 0.2:
+            message = rng.choice(messages[-50:])
+        else:
+            words = rng.choices(phrases, phrase_weights, k=rng.randint(1, 6))
+            # Some noise between phrases.
+            words += [ rng.choice(vocabulary) for n in range(rng.randint(0, 2)) ]
+            rng.shuffle(words)
+            message = ""
+            line = ""
+            for word in words:
+                line += word + " "
+                if len(line) > 70:
+                    message += line.rstrip() + "\n"
+                    line = ""
+            message = (message + line).rstrip()
+        messages.append(message)
+        part = f"#{len(messages)}\n{message}\n"
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+# Run fn(setup()) repeats times, setup is not timed.
+# Return (result of the last run, best seconds).
+# The garbage collector is off while timing, like timeit does.
+def measure_time(fn, setup=lambda: None, repeats=3):
+    best = None
+    for n in range(repeats):
+        arg = setup()
+        result = None
+        gc.collect()
+        gc.disable()
+        t0 = time.perf_counter()
+        result = fn(arg)
+        seconds = time.perf_counter() - t0
+        gc.enable()
+        if best is None or seconds < best:
+            best = seconds
+    return result, best
+
+# Run fn(setup()) once under tracemalloc, return peak bytes.
+def measure_peak(fn, setup=lambda: None):
+    arg = setup()
+    tracemalloc.start()
+    fn(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+# Seconds for a fixed tokenize, count and encode loop, similar to what the
+# pipeline does. Timings are compared in units of this.
+def calibrate(repeats=10):
+    words = [ f"W{i*2654435761 % 4093:X}" for i in range(50_000) ]
+    text = " ".join(words) + " "
+    def loop(arg):
+        tokens = [ entry[1] for entry in re.finditer("([A-Z0-9]*)( )", text) ]
+        counts = collections.Counter(tokens)
+        mapper = { token:f"{i:06b}" for i,token in enumerate(counts) }
+        return "".join(mapper[token] for token in tokens)
+    return measure_time(loop, repeats=repeats)[1]
+
+def resolve_conflicts(oportunities):
+    oportunities = lz_compress.remove_oportunities_that_end_on_the_same_byte(oportunities)
+    oportunities = lz_compress.remove_small_nested_oportunities(oportunities)
+    oportunities = lz_compress.naive_conflict_resolver(oportunities, lz_compress.M)
+    oportunities.sort(key=lambda o: o.start)
+    return oportunities
+
+def copy_oportunities(oportunities):
+    return [ lz_compress.CompressionOportunity(o.start, o.source, o.length) for o in oportunities ]
+
+def valid_oportunity(raw, o):
+    return o.source < o.start and o.start - o.source <= lz_compress.O \
+        and lz_compress.M <= o.length <= lz_compress.N and o.end() <= len(raw) \
+        and raw[o.source:o.source+o.length] == raw[o.start:o.end()]
+
+# Returns { stage: { "seconds", "throughput", "peak", "size", "valid" } }
+# Throughput is in corpus bytes per second for every stage.
+def run_pipeline(text, run_capped_stages, repeats):
+    results = {}
+    def run(stage, fn, setup=lambda: None):
+        result, seconds = measure_time(fn, setup, repeats)
+        results[stage] = {
+            "seconds"    : seconds,
+            "throughput" : len(text) / seconds if seconds else 0,
+            "peak"       : measure_peak(fn, setup),
+        }
+        return result
+    def check(stage, size, valid):
+        results[stage]["size"] = size
+        results[stage]["valid"] = valid
+
+    # Tokenization, checked against the messages with spaces removed.
+    tokenized_text = run("tokenize", lambda arg: compress.tokenize_text(text))
+    stripped = compress.tokenize_text(text, lambda msg: msg.replace(" ", ""))
+    valid = [ "".join(message) for message in tokenized_text ] == stripped
+    check("tokenize", sum(len(message) for message in tokenized_text), valid)
+
+    # Code assignment and encoding with the order-1 context tables.
+    def assign_codes(arg):
+        count_maps = compress.count_context_token_instances([tokenized_text])
+        token_count_map = collections.Counter(token for message in tokenized_text for token in message)
+        tables = compress.context_tables(count_maps, token_count_map)
+        code = compress.codegen_64(compress.context_code_a, compress.context_code_b)
+        mappers = compress.context_mappers(tables, code)
+        encoded = [ compress.encode_message_with_contexts(message, mappers)
+                    for message in tokenized_text ]
+        return tables, encoded
+    tables, encoded = run("codes", assign_codes)
+    valid = all(
+        compress.decode_message_with_contexts(
+            bits, len(message), tables, compress.context_code_a, compress.context_code_b
+        ) == message
+        for bits, message in zip(encoded, tokenized_text)
+    )
+    check("codes", sum(len(bits) for bits in encoded) // 8, valid)
+
+    if not run_capped_stages:
+        return results
+
+    # Match finding on the exported token stream, every match must be real.
+    token_count_map = collections.Counter(token for message in tokenized_text for token in message)
+    raw = compress.tokens_from_tokenized_text([tokenized_text], compress.sort_tokens_by_count(token_count_map))
+    O, M, N = lz_compress.O, lz_compress.M, lz_compress.N
+    oportunities = run("match", lambda arg: lz_compress.get_all_oportunities(raw, O,M,N))
+    check("match", len(oportunities), all(valid_oportunity(raw, o) for o in oportunities))
+
+    # Conflict resolution. Every back reference must still be a legal match,
+    # M or more symbols long, and the LZ round trip must work.
+    # Size counts symbols: one per literal, two per back reference.
+    resolved = run("resolve", resolve_conflicts, lambda: copy_oportunities(oportunities))
+    try:
+        stream = lz_compress.lz_encode(raw, resolved)
+        valid = lz_compress.lz_decode(stream) == raw \
+            and all(valid_oportunity(raw, o) for o in resolved)
+        size = sum(2 if isinstance(entry, lz_compress.CompressionOportunity) else 1 for entry in stream)
+    except ValueError:
+        valid = False
+        size = 0
+    check("resolve", size, valid)
+
+    return results
+
+# Baseline times are scaled by this run's calibration over the one stored
+# with each baseline entry. Match size is the number of matches, more is not
+# worse.
+def compare(results, baseline, time_tolerance, memory_tolerance):
+    failures = []
+    corpora = baseline.get("corpora", {})
+    for size, stage_results in results.items():
+        for stage, r in stage_results.items():
+            name = f"{size}/{stage}"
+            if not r["valid"]:
+                failures.append(f"{name}: check failed")
+            b = corpora.get(size, {}).get(stage)
+            if b is None:
+                failures.append(f"{name}: no baseline, run with --update-baseline")
+                continue
+            expected = b["seconds"] * r["calibration"] / b["calibration"]
+            if r["seconds"] > max(expected * (1 + time_tolerance), expected + time_resolution):
+                failures.append(f"{name}: {r['seconds']:.3f}s, baseline {expected:.3f}s on this machine")
+            if r["peak"] > b["peak"] * (1 + memory_tolerance):
+                failures.append(f"{name}: peak {r['peak']}B, baseline {b['peak']}B")
+            if stage != "match" and r["size"] > b["size"]:
+                failures.append(f"{name}: size {r['size']}, baseline {b['size']}")
+    return failures
+
+def print_results(results, calibration):
+    print(f"Calibration: {calibration:.4f}s")
+    print(f"{'corpus':>9} {'stage':>9} {'seconds':>9} {'kB/s':>9} {'peak kB':>9} {'size':>9} valid")
+    for size, stage_results in results.items():
+        for stage, r in stage_results.items():
+            print(f"{size:>9} {stage:>9} {r['seconds']:>9.3f} {r['throughput']/1000:>9.1f} "
+                  f"{r['peak']/1000:>9.1f} {r['size']:>9} {r['valid']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compression pipeline regression benchmark.")
+    parser.add_argument("--match-max-size", type=int, default=100_000,
+                        help="largest corpus for match and resolve, in bytes (default 100000)")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="timed runs per stage, the best one is kept (default 3)")
+    parser.add_argument("--time-tolerance", type=float, default=0.5,
+                        help="allowed slowdown over the scaled baseline (default 0.5)")
+    parser.add_argument("--memory-tolerance", type=float, default=0.10,
+                        help="allowed peak memory growth over baseline (default 0.10)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help=f"store results in {baseline_file}")
+    args = parser.parse_args()
+
+    # Calibrate before and after, the faster one is the machine speed.
+    calibration = calibrate()
+    results = {}
+    for size in corpus_sizes:
+        results[str(size)] = run_pipeline(make_corpus(size), size <= args.match_max_size, args.repeats)
+    calibration = min(calibration, calibrate())
+    for stage_results in results.values():
+        for r in stage_results.values():
+            r["calibration"] = calibration
+    print_results(results, calibration)
+
+    try:
+        with open(baseline_file, "r") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    failures = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+
+    if args.update_baseline:
+        corpora = baseline.setdefault("corpora", {})
+        for size, stage_results in results.items():
+            corpora.setdefault(size, {}).update(stage_results)
+        with open(baseline_file, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline saved to {baseline_file}")
+        failures = [ failure for failure in failures if "check failed" in failure ]
+
+    for failure in failures:
+        print("FAIL", failure)
+    sys.exit(1 if failures else 0)
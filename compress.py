@@ -13,10 +13,11 @@ textfiles = [
     "adventure/src/advent4.txt"
 ]
 
-texts = []
-for file in textfiles:
-    with open(file,"r") as f:
-        texts.append(f.read().upper())
+if __name__ == "__main__":
+    texts = []
+    for file in textfiles:
+        with open(file,"r") as f:
+            texts.append(f.read().upper())
 
 # Character mappings:
 #   ZX81 has no lowercase
@@ -56,7 +57,7 @@ def simplify_text(text):
 
 def tokenize_message(text):
     ret = []
-    for entry in re.finditer("([A-Z]*)([\"'.,/?!-+/ ])", text):
+    for entry in re.finditer("([A-Z]*)([\"'.,/?!\\-+/ ])", text):
         if entry[1]:
             ret.append(entry[1])
         if entry[2] != " ":
@@ -159,23 +160,24 @@ def token_character_counts_sorted(token_count_map, include_unused=True):
         counts = [(char,count) for (char,count) in counts if count > 0]
     return counts
 
-tokenized_text = [ tokenize_text(text) for text in texts ]
-#token_count_map    = count_token_instances(tokenized_text)
-token_count_map    = collections.Counter([word
-                                          for text in tokenized_text
-                                          for message in text
-                                          for word in message])
-token_count_sorted = sort_tokens_by_count(token_count_map)
-print(f"Longest token is {longest_token(token_count_map)} characters")
-print("Diffent tokens by size:", tokens_by_size(token_count_map))
-print("Usage count by size:", token_count_by_size(token_count_map))
-print("Unique tokens:",len(token_count_map.keys()))
-print("Sum of unique token lenghts:",token_total_length(token_count_map))
-print("Total tokens in text:",token_total_count(token_count_map))
-
-token_frequency_map = collections.Counter(token_count_map.values())
-token_frequency_distribution = [token_frequency_map[i]
-                                for i in range(max(token_frequency_map.keys())+1)]
+if __name__ == "__main__":
+    tokenized_text = [ tokenize_text(text) for text in texts ]
+    #token_count_map    = count_token_instances(tokenized_text)
+    token_count_map    = collections.Counter([word
+                                              for text in tokenized_text
+                                              for message in text
+                                              for word in message])
+    token_count_sorted = sort_tokens_by_count(token_count_map)
+    print(f"Longest token is {longest_token(token_count_map)} characters")
+    print("Diffent tokens by size:", tokens_by_size(token_count_map))
+    print("Usage count by size:", token_count_by_size(token_count_map))
+    print("Unique tokens:",len(token_count_map.keys()))
+    print("Sum of unique token lenghts:",token_total_length(token_count_map))
+    print("Total tokens in text:",token_total_count(token_count_map))
+
+    token_frequency_map = collections.Counter(token_count_map.values())
+    token_frequency_distribution = [token_frequency_map[i]
+                                    for i in range(max(token_frequency_map.keys())+1)]
 
 def VLQ4_encode(n):
     r = ""
@@ -286,21 +288,28 @@ def codegen_64(a,b):
             r.append(f"{i:06b}{j:010b}")
     return r
 
-def export_tokenized_text():
+# Token i of token_count_sorted becomes i+2.
+# 0 ends a message, 1 ends a text.
+def tokens_from_tokenized_text(tokenized_texts, token_count_sorted):
     mapper = {}
     for i in range(len(token_count_sorted)):
         word = token_count_sorted[i][0]
         mapper[word] = i+2
 
     tokens = []
-    for text in tokenized_text:
+    for text in tokenized_texts:
         for message in text:
             for word in message:
                 tokens.append(mapper[word])
             tokens.append(0)
         tokens.append(1)
-    np.save("tokenized_text.npy", tokens)
-export_tokenized_text();
+    return tokens
+
+def export_tokenized_text():
+    np.save("tokenized_text.npy", tokens_from_tokenized_text(tokenized_text, token_count_sorted))
+
+if __name__ == "__main__":
+    export_tokenized_text();
 
 # Text includes
 #   ~10k tokens used for full-text.
@@ -351,4 +360,135 @@ def test_compress_text():
     print("Total bytes, uncompressed...:", uncompressed_bytes)
     print("Total bytes, compressed.....:", compressed_bytes)
 
-test_compress_text()
+if __name__ == "__main__":
+    test_compress_text()
+
+# Order-1 context model.
+# Messages alternate words and separators, with implicit spaces, so the class
+# of the previous token is a good hint of what comes next. After a word, code
+# straight into the shared dictionary order. At the start of a message and
+# after a separator, go through a small remap table of indices into the shared
+# dictionary. Switch tables after each decoded token.
+CONTEXT_START     = 0
+CONTEXT_WORD      = 1
+CONTEXT_SEPARATOR = 2
+context_names = [ "start", "word", "separator" ]
+
+# Contexts with a remap table in flash, the word context has none.
+remapped_contexts = [ CONTEXT_START, CONTEXT_SEPARATOR ]
+
+# Context tables use codegen_64(context_code_a, context_code_b).
+context_code_a, context_code_b = 30, 2
+
+def token_context(previous_token):
+    if previous_token is None:
+        return CONTEXT_START
+    if re.fullmatch("[A-Z]+", previous_token):
+        return CONTEXT_WORD
+    return CONTEXT_SEPARATOR
+
+def count_context_token_instances(tokenized_texts):
+    ret = [ collections.Counter() for name in context_names ]
+    for tokenized_text in tokenized_texts:
+        for message in tokenized_text:
+            previous_token = None
+            for token in message:
+                ret[token_context(previous_token)][token] += 1
+                previous_token = token
+    return ret
+
+# Table is sorted by decreasing frequency, entry i gets code[i].
+def context_table(token_count_map):
+    table = sort_tokens_by_count(token_count_map)
+    table.reverse()
+    return [ token for token,count in table ]
+
+# One table per context. The word context uses the shared table, sorted by
+# overall frequency, which is the dictionary order and costs no extra flash.
+def context_tables(context_count_maps, token_count_map):
+    tables = [ context_table(count_map) for count_map in context_count_maps ]
+    tables[CONTEXT_WORD] = context_table(token_count_map)
+    return tables
+
+# Inverse of codegen_64: read one code from bits at off, return (index, bits used).
+# The first 6 bits alone define the code length, so this is constant time.
+def codegen_64_decode(bits, off, a, b):
+    i = int(bits[off:off+6], 2)
+    if i < 64-a:
+        return i, 6
+    if i < 64-b:
+        return (64-a) + 4*(i-(64-a)) + int(bits[off+6:off+8], 2), 8
+    return (64-a) + 4*(a-b) + 2**10*(i-(64-b)) + int(bits[off+6:off+16], 2), 16
+
+def context_mappers(tables, code):
+    return [ { token:code[i] for i,token in enumerate(table) } for table in tables ]
+
+def encode_message_with_contexts(message, mappers):
+    bits = ""
+    previous_token = None
+    for token in message:
+        bits += mappers[token_context(previous_token)][token]
+        previous_token = token
+    return bits
+
+# Message length comes from the message index, not from the bitstream.
+# Each token costs one code read and one table lookup.
+def decode_message_with_contexts(bits, length, tables, a, b):
+    ret = []
+    previous_token = None
+    off = 0
+    for n in range(length):
+        index, used = codegen_64_decode(bits, off, a, b)
+        off += used
+        token = tables[token_context(previous_token)][index]
+        ret.append(token)
+        previous_token = token
+    return ret
+
+def test_compress_text_with_context():
+    codelen = 1/8
+    code = codegen_64(context_code_a, context_code_b)
+
+    # Reference: the single shared table from test_compress_text().
+    shared_table = context_table(token_count_map)
+    shared_mapper = { token:code[i] for i,token in enumerate(shared_table) }
+
+    context_count_maps = count_context_token_instances(tokenized_text)
+    tables = context_tables(context_count_maps, token_count_map)
+
+    # Remap tables hold 2-byte indices into the shared word dictionary.
+    table_entry_bytes = 2
+
+    print("Order-1 context coding, previous token class:")
+    print(f"{'context':>10} {'tokens':>7} {'entries':>7} {'shared':>9} {'context':>9} {'saved':>9} {'table':>7}")
+    total_saved = 0
+    total_table = 0
+    for context, (name, count_map, table) in enumerate(zip(context_names, context_count_maps, tables)):
+        mapper = { token:code[i] for i,token in enumerate(table) }
+        shared_bytes  = codelen * sum([count*len(shared_mapper[token]) for token,count in count_map.items()])
+        context_bytes = codelen * sum([count*len(mapper[token]) for token,count in count_map.items()])
+        saved = shared_bytes - context_bytes
+        table_bytes = table_entry_bytes * len(table) if context in remapped_contexts else 0
+        total_saved += saved
+        total_table += table_bytes
+        entries = len(table) if context in remapped_contexts else 0
+        print(f"{name:>10} {sum(count_map.values()):>7} {entries:>7} {shared_bytes:>9} {context_bytes:>9} {saved:>9} {table_bytes:>7}")
+
+    print("Total bytes saved...........:", total_saved)
+    print("Extra table flash...........:", total_table)
+    print("Net bytes saved.............:", total_saved - total_table)
+
+    # Round trip every message through the context tables.
+    mappers = context_mappers(tables, code)
+    valid = all(
+        decode_message_with_contexts(
+            encode_message_with_contexts(message, mappers),
+            len(message), tables, context_code_a, context_code_b
+        ) == message
+        for text in tokenized_text
+        for message in text
+    )
+    print("Validate:", valid)
+
+if __name__ == "__main__":
+    test_compress_text_with_context()
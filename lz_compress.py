@@ -2,6 +2,10 @@
 import sys
 import numpy as np
 
+O = 2**8 - 1    # lookback distance
+M = 3           # minimum viable compression size
+N = 2**8 -1 + M # maximum compression size
+
 class CompressionOportunity:
     def __init__(self, _start, _source, _length):
         self.start  = _start
@@ -11,15 +15,17 @@ class CompressionOportunity:
         return self.start + self.length
     def overlaps(self, other):
         return ( self.start >= other.start and  self.start < other.end()) \
-            or (other.start >= self.start  and othen.start <  self.end())
+            or (other.start >= self.start  and other.start <  self.end())
     def covers(self, other):
-        return self.start <= othen.start and self.end() >= other.end()
+        return self.start <= other.start and self.end() >= other.end()
 
 def test_oportunity(want, have, O,M,N):
-    if want[0:M] != have[0:M]:
+    # Both may be cut short at the end of raw, never match past that.
+    longest = min(N-1, len(want), len(have))
+    if longest < M or want[0:M] != have[0:M]:
         return 0
 
-    for m in range(N-1, M-1, -1):
+    for m in range(longest, M-1, -1):
         if want[0:m] == have[0:m]:
             return m
     return 0
@@ -65,7 +71,7 @@ def is_contained(external, internal):
 def are_overlapping(oportunity1, oportunity2):
     a = oportunity1
     b = oportunity2
-    return (b.start >= a.start and b.start < b.end()) or (a.start >= b.start and a.start < b.end())
+    return (b.start >= a.start and b.start < a.end()) or (a.start >= b.start and a.start < b.end())
 
 def remove_small_nested_oportunities(oportunities):
     p = 0 # previous index
@@ -133,7 +139,7 @@ def cluster_size_distribution(clusters):
         sizes[len(cluster)] += 1
     return sizes
 
-def naive_conflict_resolver(oportunities):
+def naive_conflict_resolver(oportunities, M):
     p = 0
     n = 1
     while n < len(oportunities):
@@ -159,6 +165,10 @@ def naive_conflict_resolver(oportunities):
             no.source += overlap
             no.length -= overlap
             oportunities[n] = no
+            # Too short to pay for a back reference now.
+            if no.length < M:
+                oportunities.pop(n)
+                n = n-1
         n = n+1
         if n == len(oportunities):
             p = p+1
@@ -182,20 +192,45 @@ def uncompressed_symbol_frequency(raw, oportunities):
             r += 1
     return counts
 
+# Replace each oportunity by a back reference to its source.
+# Oportunities must be sorted by start and must not overlap.
+def lz_encode(raw, oportunities):
+    stream = []
+    o = 0
+    r = 0
+    while r < len(raw):
+        if o < len(oportunities) and r > oportunities[o].start:
+            raise ValueError(f"Oportunity at {oportunities[o].start} overlaps or is out of order.")
+        if o < len(oportunities) and r == oportunities[o].start:
+            stream.append(oportunities[o])
+            r += oportunities[o].length
+            o += 1
+        else:
+            stream.append(raw[r])
+            r += 1
+    return stream
+
+def lz_decode(stream):
+    raw = []
+    for entry in stream:
+        if isinstance(entry, CompressionOportunity):
+            # Copy one symbol at a time, source may overlap the destination.
+            for k in range(entry.length):
+                raw.append(raw[entry.source + k])
+        else:
+            raw.append(entry)
+    return raw
+
 if __name__ == "__main__":
     raw = list(np.load("tokenized_text.npy"))
     #raw = open("simplified_text.txt","r").read();
 
-    O = 2**8 - 1    # lookback distance
-    M = 3           # minimum viable compression size
-    N = 2**8 -1 + M # maximum compression size
-
     print(list(range(N-1, M-1, -1)))
     print(f"O {O}, M {M}, N {N}")
     oportunities = get_all_oportunities(raw, O,M,N)
     conflicts = count_conflicting_oportunities(oportunities)
-    bytes_saveable = sum(o[2] for o in oportunities)
-    largest_oportunity = max(m for i,j,m in oportunities)
+    bytes_saveable = sum(o.length for o in oportunities)
+    largest_oportunity = max(o.length for o in oportunities)
     size_distribution = oportunity_size_distribution(oportunities)
 
     print("Total oportunities:")
@@ -208,8 +243,8 @@ if __name__ == "__main__":
     oportunities = remove_oportunities_that_end_on_the_same_byte(oportunities)
     oportunities = remove_small_nested_oportunities(oportunities)
     conflicts = count_conflicting_oportunities(oportunities)
-    bytes_saveable = sum(o[2] for o in oportunities)
-    largest_oportunity = max(m for i,j,m in oportunities)
+    bytes_saveable = sum(o.length for o in oportunities)
+    largest_oportunity = max(o.length for o in oportunities)
     size_distribution = oportunity_size_distribution(oportunities)
 
     print("Selected oportunities:")
@@ -231,6 +266,6 @@ if __name__ == "__main__":
         if len(cluster) < 9: continue
         print(f"Cluster: {len(cluster)} conflicts.")
         for oportunity in cluster:
-            i,j,m = oportunity
+            i,j,m = oportunity.start, oportunity.source, oportunity.length
             data = raw[j:j+m]#.replace("\n","\\n")
             print(f"  Oportunity: {i:6}, {j:6}, {m:3}, \"{data}\"")